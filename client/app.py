@@ -1,142 +1,369 @@
 import logging
 import uuid
-import json
 import asyncio
 import os
+import sys
 import signal
-
+import ssl
+import gzip
+import shutil
+import tempfile
+import pathlib
+
+import ijson
+import orjson
 import sockjs
+import uvloop
 
-from aiohttp import web, ClientSession
-from stompest.protocol import StompParser, StompFrame
+from aiohttp import web, ClientSession, TCPConnector
+from aiohttp.file_sender import FileSender
+from stompest.protocol import StompParser
 
 # Enable logging an INFO level so can see requests.
 
 logging.basicConfig(level=logging.INFO)
 
-async def get_backend_info(url):
+# Use uvloop for the asyncio event loop. This must be done before the
+# aiohttp application is created as it is bound to the event loop at
+# the time it is created.
+
+uvloop.install()
+
+# The fields of the backend service info which the user interface uses.
+# Any other fields returned by the backend service are ignored.
+
+BACKEND_INFO_FIELDS = frozenset(('id', 'displayName', 'center', 'zoom',
+        'maxZoom', 'type', 'visible', 'scope'))
+
+async def get_backend_info(session, url):
     url = url + 'ws/info/'
 
-    async with ClientSession() as session:
-        async with session.get(url) as response:
-            data = await response.read()
+    # The callers bound the overall time taken, including reading the
+    # response, so no timeout is given for the request here.
+
+    async with session.get(url) as response:
+        if response.status != 200:
+            return
+
+        # Rather than read and parse the whole response, the response is
+        # parsed as it is read and we only keep the top level fields we
+        # are interested in, stopping as soon as we have all of them.
+
+        info = {}
+
+        async for key, value in ijson.kvitems(response.content, '',
+                use_float=True):
+            if key in BACKEND_INFO_FIELDS:
+                info[key] = value
+
+                if len(info) == len(BACKEND_INFO_FIELDS):
+                    break
 
-    if response.status == 200:
-        info = json.loads(data.decode('UTF-8'))
+    # We need to fill in some defaults for values if the
+    # service doesn't define them as the user interface
+    # expects all fields to be populated.
 
-        # We need to fill in some defaults for values if the
-        # service doesn't define them as the user interface
-        # expects all fields to be populated.
+    info.setdefault('center', {"latitude":"0.0","longitude":"0.0"})
+    info.setdefault('zoom', 1)
+    info.setdefault('maxZoom', 1)
+    info.setdefault('type', 'cluster')
+    info.setdefault('visible', 'true')
+    info.setdefault('scope', 'all')
 
-        info.setdefault('center', {"latitude":"0.0","longitude":"0.0"})
-        info.setdefault('zoom', 1)
-        info.setdefault('maxZoom', 1)
-        info.setdefault('type', 'cluster')
-        info.setdefault('visible', 'true')
-        info.setdefault('scope', 'all')
+    return info
 
-        return info
+# The list of backend services. The end point is combination of
+# service name and port.
+
+def get_backend_endpoints():
+    backends = os.environ.get('BACKEND_SERVICES', 'notebook:8080')
+
+    return [(backend, 'http://%s/' % backend)
+            for backend in backends.split(',')]
 
 # Background task that periodically polls the list of backend services.
+# Notifications are sent to the user interface on the topics below.
+# These are interned, as are the destinations when sessions subscribe,
+# so looking up subscriptions by topic can compare strings by identity.
+#
+# The batch topics carry a list of all the services added or removed
+# at one time in a single message. The original topics, which carry a
+# message per service, are still sent for any page loaded from an older
+# version of the user interface.
+
+TOPIC_ADD = sys.intern('/topic/add')
+TOPIC_REMOVE = sys.intern('/topic/remove')
+TOPIC_ADD_BATCH = sys.intern('/topic/add-batch')
+TOPIC_REMOVE_BATCH = sys.intern('/topic/remove-batch')
 
 backend_details = {}
 
 def broadcast_message(topic, info):
-    manager = sockjs.get_manager('clients', app)
+    subscribers = app['subs_by_topic'].get(topic)
+
+    # Nothing to do if no sessions are subscribed to the topic.
+
+    if not subscribers:
+        return
+
+    # The message body and all but the per session headers of the Stomp
+    # MESSAGE frame are the same for every session, so we only generate
+    # them once and then fill in the subscription and message id for
+    # each session.
+
+    body = orjson.dumps(info)
+
+    prefix = ('MESSAGE\ncontent-type:application/json\n'
+            'content-length:%d\n' % len(body))
+    suffix = '\n%s\x00' % body.decode('UTF-8')
+
+    # Sending a message only queues it for the session, so we don't wait
+    # on each session in turn. Any failure sending to one session is
+    # logged and ignored so it doesn't prevent the message being sent to
+    # the remaining sessions.
 
-    for session in manager.sessions:
+    for session, subscription in list(subscribers.values()):
         if not session.expired:
-            if hasattr(session, 'subscriptions'):
-                if topic in session.subscriptions:
-                    subscription = session.subscriptions[topic]
+            try:
+                session.send('%ssubscription:%s\nmessage-id:%s\n%s' % (
+                        prefix, subscription, uuid.uuid4().hex, suffix))
+            except Exception:
+                logging.debug('Could not send message to session %s.',
+                        session.id, exc_info=True)
 
-                    headers = {}
-                    headers['subscription'] = subscription
-                    headers['content-type'] = 'application/json'
-                    headers['message-id'] = str(uuid.uuid1())
+def broadcast_backends(topic, batch_topic, infos):
+    broadcast_message(batch_topic, infos)
 
-                    body = json.dumps(info).encode('UTF-8')
+    for info in infos:
+        broadcast_message(topic, info)
 
-                    frame = StompFrame(command='MESSAGE',
-                            headers=headers, body=body)
+# How often to poll the backend services. When all the backend services
+# are being watched successfully, polling is only done at the longer
+# reconcile interval.
 
-                    session.send(bytes(frame).decode('UTF-8'))
+POLL_INTERVAL = 15.0
+RECONCILE_INTERVAL = 300.0
 
-async def poll_backends():
+def watching_backends():
+    watches = app['backend_watches']
+    return bool(watches) and all(watches.values())
+
+async def update_backends(session, endpoints):
     global backend_details
 
-    loop = asyncio.get_event_loop()
+    details = {}
+
+    # Query details for each backend service. The backends are all
+    # queried at the same time, with a timeout so that a backend
+    # which is slow to respond doesn't hold up the others.
+
+    tasks = [asyncio.wait_for(get_backend_info(session, url), timeout=5.0)
+            for name, url in endpoints]
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    for (name, url), info in zip(endpoints, results):
+        # We will get an exception if the lookup of details for the
+        # service failed or timed out, or None if the service did
+        # not return a successful response.
+
+        if info is None or isinstance(info, BaseException):
+            continue
+
+        # Ignore the backend if it doesn't provide an id field.
+
+        if 'id' not in info:
+            continue
+
+        details[info['id']] = (name, url, info)
+
+    # Work out what services were added or removed since the last time
+    # we ran this. Send notifications to the user interface about
+    # whether services were added or removed. All the services added
+    # or removed are sent as a list in a single message.
+
+    added = details.keys() - backend_details.keys()
+    removed = backend_details.keys() - details.keys()
+
+    if removed:
+        broadcast_backends(TOPIC_REMOVE, TOPIC_REMOVE_BATCH,
+                [backend_details[key][2] for key in removed])
+
+    if added:
+        broadcast_backends(TOPIC_ADD, TOPIC_ADD_BATCH,
+                [details[key][2] for key in added])
+
+    # Update our global record of what services we know about.
+
+    backend_details = details
+
+async def poll_backends():
+    session = app['http_session']
+
+    # Get the list of backend services. This is static configuration so
+    # only needs to be worked out once.
+
+    endpoints = get_backend_endpoints()
+
+    last_poll = None
 
     while True:
-        details = {}
+        # Wait a while and then update list again, unless the backend
+        # services are being watched, in which case we only need to do
+        # so when the reconcile interval has passed.
+
+        if last_poll is not None:
+            await asyncio.sleep(POLL_INTERVAL)
+
+            if (watching_backends() and app.loop.time() - last_poll
+                    < RECONCILE_INTERVAL):
+                continue
+
+        last_poll = app.loop.time()
+
+        # Polling and the watch of endpoints both update the record of
+        # backend services, so they hold a lock to ensure they don't
+        # overwrite each other's changes with stale results.
+
+        async with app['backend_lock']:
+            await update_backends(session, endpoints)
+
+# When running in OpenShift, rather than relying only on polling, we
+# watch the endpoints of the backend services via the REST API. When
+# the endpoints of a service change, we query just that backend service
+# straight away. Polling is still done but, once all the watches are
+# working, at a much longer interval, to reconcile against anything the
+# watch may have missed. The state of each watch is recorded so that
+# polling reverts to the shorter interval if any watch is failing, for
+# example where the service account doesn't have permission to watch
+# endpoints.
+
+SERVICE_ACCOUNT_DIR = '/var/run/secrets/kubernetes.io/serviceaccount'
+
+def running_in_cluster():
+    return (os.path.exists(os.path.join(SERVICE_ACCOUNT_DIR, 'token'))
+            and 'KUBERNETES_SERVICE_HOST' in os.environ)
+
+async def refresh_backend(session, name, url):
+    global backend_details
+
+    try:
+        info = await asyncio.wait_for(get_backend_info(session, url),
+                timeout=5.0)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        info = None
+
+    if info is not None and 'id' not in info:
+        info = None
 
-        # Get the list of backend services.
+    # Work out whether the backend service was added or removed, or
+    # has changed its id, and send notifications to the user interface.
+
+    details = dict(backend_details)
+
+    removed = []
+
+    for key, (old_name, old_url, old_info) in backend_details.items():
+        if old_name == name and (info is None or key != info['id']):
+            del details[key]
+            removed.append(old_info)
+
+    if removed:
+        broadcast_backends(TOPIC_REMOVE, TOPIC_REMOVE_BATCH, removed)
+
+    if info is not None and info['id'] not in details:
+        details[info['id']] = (name, url, info)
+        broadcast_backends(TOPIC_ADD, TOPIC_ADD_BATCH, [info])
+
+    backend_details = details
+
+async def watch_endpoints(kubernetes, url, headers, resource, entries):
+    session = app['http_session']
+
+    params = {'watch': 'true', 'fieldSelector': 'metadata.name=%s' % resource}
+
+    while True:
+        # The watch will be closed by the server every so often, so we
+        # need to keep reconnecting. Each time we reconnect, we will get
+        # an event for the existing endpoints resource, with the backend
+        # services being queried again.
 
         try:
-            backends = os.environ.get('BACKEND_SERVICES', 'notebook:8080')
+            async with kubernetes.get(url, headers=headers, params=params,
+                    timeout=None) as response:
 
-            endpoints = []
-            for backend in backends.split(','):
-                endpoints.append((backend, 'http://%s/' % backend))
+                if response.status != 200:
+                    raise RuntimeError('Watch of endpoints %s failed with '
+                            'status %d.' % (resource, response.status))
 
-        except Exception:
-            logging.exception('Could not query backends.')
+                app['backend_watches'][resource] = True
 
-            # Wait a while and then update list again.
+                async for line in response.content:
+                    if not line.strip():
+                        continue
 
-            await asyncio.sleep(15.0)
+                    async with app['backend_lock']:
+                        for name, backend_url in entries:
+                            await refresh_backend(session, name, backend_url)
 
-            continue
+        except asyncio.CancelledError:
+            raise
 
-        # Query details for each backend service. The end point is
-        # combination of service name and port.
+        except Exception as e:
+            # Only log the failure when the watch first fails, rather
+            # than on every attempt to watch again.
 
-        for name, url in endpoints:
-            try:
-                info = await get_backend_info(url)
-            except Exception as e:
-                pass
-            else:
-                # We will get None if lookup of details failed for service.
+            if app['backend_watches'][resource] is not False:
+                logging.warning('Could not watch backends: %s', e)
 
-                if info is None:
-                    continue
+            app['backend_watches'][resource] = False
 
-                # Ignore the backend if it doesn't provide an id field.
+            # Wait a while and then try watching again.
 
-                if 'id' not in info:
-                    continue
+            await asyncio.sleep(15.0)
 
-                details[info['id']] = (name, url, info)
+async def watch_backends():
+    # Map the name of the service, as would be used for the endpoints
+    # resource, back to the backend service entries. Only services in
+    # the same project, given by just the service name, can be watched.
 
-        # Work out what services were added or removed since the last time
-        # we ran this. Send notifications to the user interface about
-        # whether services were added or removed.
+    services = {}
 
-        added = set()
-        removed = set(backend_details.keys())
+    for name, url in get_backend_endpoints():
+        resource = name.split(':')[0]
 
-        for name in details:
-            if name in removed:
-                removed.remove(name)
-            if name not in backend_details:
-                added.add(name)
+        if '.' not in resource:
+            services.setdefault(resource, []).append((name, url))
+            app['backend_watches'][resource] = None
 
-        for key in removed:
-            name, url, info = backend_details[key]
-            broadcast_message('/topic/remove', info)
+        else:
+            app['backend_watches'][resource] = False
 
-        for key in added:
-            name, url, info = details[key]
-            broadcast_message('/topic/add', info)
+    with open(os.path.join(SERVICE_ACCOUNT_DIR, 'token')) as fp:
+        token = fp.read().strip()
 
-        # Update our global record of what services we know about.
+    with open(os.path.join(SERVICE_ACCOUNT_DIR, 'namespace')) as fp:
+        namespace = fp.read().strip()
 
-        backend_details = details
+    url = 'https://%s:%s/api/v1/namespaces/%s/endpoints' % (
+            os.environ['KUBERNETES_SERVICE_HOST'],
+            os.environ.get('KUBERNETES_SERVICE_PORT', '443'), namespace)
 
-        # Wait a while and then update list again.
+    headers = {'Authorization': 'Bearer %s' % token}
 
-        await asyncio.sleep(15.0)
+    context = ssl.create_default_context(
+            cafile=os.path.join(SERVICE_ACCOUNT_DIR, 'ca.crt'))
+
+    # Each service is watched separately, selecting the endpoints
+    # resource by name, so we only get events for the backend services.
+
+    async with ClientSession(connector=TCPConnector(
+            ssl_context=context)) as kubernetes:
+
+        await asyncio.gather(*[watch_endpoints(kubernetes, url, headers,
+                resource, entries) for resource, entries in services.items()])
 
 # The aiohttp application.
 
@@ -146,6 +373,21 @@ app = web.Application()
 # web socket and then Stomp messaging is used on top. The Stomp module
 # only provides message framing, so we need to implemented the
 # handshakes ourself which the JS Stomp client is expecting.
+#
+# Subscriptions are indexed by topic so that when broadcasting a
+# message we only need to visit the sessions subscribed to that topic.
+# Each topic maps session id to the session and subscription id.
+
+app['subs_by_topic'] = {}
+
+def unsubscribe_session(session, destination):
+    subscribers = app['subs_by_topic'].get(destination)
+
+    if subscribers is not None:
+        subscribers.pop(session.id, None)
+
+        if not subscribers:
+            del app['subs_by_topic'][destination]
 
 def socks_backend(msg, session):
     parser = StompParser('1.1')
@@ -162,35 +404,127 @@ def socks_backend(msg, session):
 
     elif msg.tp == sockjs.MSG_MESSAGE:
         if frame.command == 'CONNECT':
-            headers = {}
-            headers['session'] = session.id
+            session.send('CONNECTED\nsession:%s\n\n\x00' % session.id)
 
-            msg = StompFrame(command='CONNECTED', headers=headers)
-
-            session.send(bytes(msg).decode('UTF-8'))
+            for destination in getattr(session, 'subscriptions', {}):
+                unsubscribe_session(session, destination)
 
             session.subscriptions = {}
 
         elif frame.command == 'SUBSCRIBE':
+            destination = sys.intern(frame.headers['destination'])
             subscription = frame.headers['id']
-            session.subscriptions[frame.headers['destination']] = subscription
+
+            session.subscriptions[destination] = subscription
+
+            app['subs_by_topic'].setdefault(destination, {})[session.id] = (
+                    session, subscription)
 
         elif frame.command == 'UNSUBSCRIBE':
-            del session.subscriptions[frame.headers['destination']]
+            destination = frame.headers['destination']
+
+            del session.subscriptions[destination]
+
+            unsubscribe_session(session, destination)
 
     elif msg.tp == sockjs.MSG_CLOSE:
         pass
 
     elif msg.tp == sockjs.MSG_CLOSED:
-        pass
+        for destination in getattr(session, 'subscriptions', {}):
+            unsubscribe_session(session, destination)
 
 sockjs.add_endpoint(app, socks_backend, name='clients', prefix='/socks-backends/')
 
-# Our REST API endpoints which the web interface uses.
+# When the application is shutting down, close all the SockJS sessions.
+# Otherwise the connections for any attached browsers are left open and
+# the server would wait on them until the shutdown timeout expired.
+
+async def shutdown_clients(app):
+    await sockjs.get_manager('clients', app).clear()
+
+app.on_shutdown.append(shutdown_clients)
+
+# A single client session is shared for all requests made against the
+# backend services, both when polling and when proxying requests for
+# data, so that connections to the backends can be reused. The number
+# of requests for data being proxied at the same time is limited so
+# that the backends aren't overwhelmed. The polling and watch tasks are
+# only started once the client session has been created.
+#
+# Host name lookups for the backends are cached by the connector. The
+# cache has no expiry of its own, so it is cleared periodically so that
+# changes to where a service resolves to are picked up.
+
+DNS_CACHE_TTL = 300.0
+
+def expire_dns_cache(app):
+    app['http_session'].connector.clear_dns_cache()
+
+    app['dns_cache_expiry'] = app.loop.call_later(DNS_CACHE_TTL,
+            expire_dns_cache, app)
+
+async def startup_backends(app):
+    connector = TCPConnector(limit=100, use_dns_cache=True,
+            keepalive_timeout=60, force_close=False)
+
+    app['http_session'] = ClientSession(connector=connector)
+    app['http_semaphore'] = asyncio.Semaphore(20)
+
+    app['dns_cache_expiry'] = app.loop.call_later(DNS_CACHE_TTL,
+            expire_dns_cache, app)
+
+    app['backend_lock'] = asyncio.Lock()
+    app['backend_watches'] = {}
+
+    app['backend_tasks'] = [asyncio.ensure_future(poll_backends())]
+
+    if running_in_cluster():
+        app['backend_tasks'].append(asyncio.ensure_future(watch_backends()))
+
+async def cleanup_backends(app):
+    for task in app['backend_tasks']:
+        task.cancel()
+
+    # Wait for the tasks to finish being cancelled, so they are no longer
+    # using the client session when it is closed, and so any client
+    # session they created themselves is closed.
+
+    await asyncio.gather(*app['backend_tasks'], return_exceptions=True)
+
+    app['dns_cache_expiry'].cancel()
+
+    await app['http_session'].close()
+
+app.on_startup.append(startup_backends)
+app.on_cleanup.append(cleanup_backends)
+
+# Our REST API endpoints which the web interface uses. Requests for
+# data are proxied through to the backend services.
+
+async def proxy_response(request, response):
+    # The data is already JSON as returned by the backend service, so
+    # rather than reading the whole data set into memory, we stream it
+    # direct from the backend into the response to the web interface.
+
+    resp = web.StreamResponse(status=response.status)
+    resp.headers['Content-Type'] = response.headers.get('Content-Type',
+            'application/json')
+
+    await resp.prepare(request)
+
+    async for chunk in response.content.iter_chunked(64*1024):
+        resp.write(chunk)
+        await resp.drain()
+
+    await resp.write_eof()
+
+    return resp
 
 async def backends_list(request):
     details = [info for name, url, info in backend_details.values()]
-    return web.json_response(details)
+    return web.Response(body=orjson.dumps(details),
+            content_type='application/json')
 
 app.router.add_get('/ws/backends/list', backends_list)
 
@@ -200,18 +534,11 @@ async def data_all(request):
     name, url, info = backend_details[service]
     url =  url + 'ws/data/all'
 
-    # XXX Need to find a better way of doing this. It currently reads
-    # the whole data set into memory before returning it. Need to work
-    # out how can stream the response from backend direct into response
-    # to the web interface.
-
-    async with ClientSession() as session:
-        async with session.get(url) as response:
-            data = await response.read()
+    session = request.app['http_session']
 
-    data = json.loads(data.decode('UTF-8'))
-
-    return web.json_response(data, status=response.status)
+    async with request.app['http_semaphore']:
+        async with session.get(url, timeout=10.0) as response:
+            return await proxy_response(request, response)
 
 app.router.add_get('/ws/data/all', data_all)
 
@@ -221,18 +548,12 @@ async def data_within(request):
     name, url, info = backend_details[service]
     url = url + 'ws/data/within'
 
-    # XXX Need to find a better way of doing this. It currently reads
-    # the whole data set into memory before returning it. Need to work
-    # out how can stream the response from backend direct into response
-    # to the web interface.
-
-    async with ClientSession() as session:
-        async with session.get(url, params=request.rel_url.query) as response:
-            data = await response.read()
+    session = request.app['http_session']
 
-    data = json.loads(data.decode('UTF-8'))
-
-    return web.json_response(data, status=response.status)
+    async with request.app['http_semaphore']:
+        async with session.get(url, params=request.rel_url.query,
+                timeout=10.0) as response:
+            return await proxy_response(request, response)
 
 app.router.add_get('/ws/data/within', data_within)
 
@@ -248,28 +569,114 @@ app.router.add_get('/', index)
 
 app.router.add_static('/', 'static')
 
+# The static files for the web interface are compressed once when the
+# application starts. When the browser accepts gzip encoding, the
+# compressed version of a file is returned instead. The compressed files
+# are kept in a separate directory as the directory the static files are
+# in may not be writable.
+
+STATIC_COMPRESS_TYPES = ('.html', '.js', '.css')
+
+async def startup_static(app):
+    directory = tempfile.mkdtemp(prefix='static-')
+
+    app['static_gzip_dir'] = directory
+    app['static_gzip'] = {}
+
+    for root, dirs, files in os.walk('static'):
+        for name in files:
+            if not name.endswith(STATIC_COMPRESS_TYPES):
+                continue
+
+            source = os.path.join(root, name)
+            path = os.path.relpath(source, 'static')
+            target = os.path.join(directory, path + '.gz')
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            with open(source, 'rb') as src, gzip.open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+
+            url = '/' + pathlib.PurePath(path).as_posix()
+
+            app['static_gzip'][url] = pathlib.Path(target)
+
+async def cleanup_static(app):
+    shutil.rmtree(app['static_gzip_dir'], ignore_errors=True)
+
+app.on_startup.append(startup_static)
+app.on_cleanup.append(cleanup_static)
+
+def static_gzip_response():
+    resp = web.StreamResponse()
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+static_gzip_sender = FileSender(resp_factory=static_gzip_response,
+        chunk_size=256*1024)
+
+def accepts_gzip(request):
+    # Work out the quality value given for gzip in the Accept-Encoding
+    # header, falling back to that for any encoding. A quality value of
+    # zero means the encoding must not be used.
+
+    qvalues = {}
+
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        coding, *params = item.split(';')
+        coding = coding.strip().lower()
+
+        if not coding:
+            continue
+
+        qvalue = 1.0
+
+        for param in params:
+            key, _, value = param.partition('=')
+
+            if key.strip().lower() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+
+        qvalues[coding] = qvalue
+
+    return qvalues.get('gzip', qvalues.get('*', 0.0)) > 0.0
+
+async def static_gzip_middleware(app, handler):
+    async def middleware(request):
+        if request.method in ('GET', 'HEAD'):
+            target = app['static_gzip'].get(request.path)
+
+            if target is not None and accepts_gzip(request):
+                return await static_gzip_sender.send(request, target)
+
+        return await handler(request)
+
+    return middleware
+
+app.middlewares.append(static_gzip_middleware)
+
 # Main application startup.
 
 if __name__ == '__main__':
     loop = asyncio.get_event_loop()
 
-    @asyncio.coroutine 
-    def shutdown_application():
-        logging.info('Application stopped')
-        loop.stop()
+    # On SIGTERM we only need to stop the event loop. The aiohttp server
+    # will then close the listening socket, run the shutdown handlers,
+    # which close the SockJS sessions, finish any connections, and run
+    # the cleanup handlers, which cancel the background tasks and close
+    # the client session.
 
-    def schedule_shutdown():                          
+    def shutdown_application():
         logging.info('Stopping application')
-        for task in asyncio.Task.all_tasks():
-            task.cancel()                    
-        asyncio.ensure_future(shutdown_application()) 
-
-    loop.add_signal_handler(signal.SIGTERM, schedule_shutdown)
-
-    # Start up our background task to poll for backend services.
+        loop.stop()
 
-    asyncio.ensure_future(poll_backends(), loop=loop)
+    loop.add_signal_handler(signal.SIGTERM, shutdown_application)
 
-    # Run the aiohttpd server.
+    # Run the aiohttpd server. The time allowed for finishing connections
+    # on shutdown is kept well inside the default termination grace
+    # period of 30 seconds used by OpenShift.
 
-    web.run_app(app)
+    web.run_app(app, shutdown_timeout=10.0)